@@ -0,0 +1,78 @@
+"""Stand-in for llama.cpp's llama-server, for running the 'local' provider without a model.
+
+Accepts the llama-server flags local_llm.py passes (-m, -t are ignored) and
+serves /health and /completion, echoing a canned reply word by word.
+
+    LOCAL_LLM_COMMAND="python benchmarks/fake_llama_server.py --port {port} --token-delay 0.01" \
+        python motivation_bot.py
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = ("You've got this! Break the task into three small steps, start with the "
+         "easiest one, and reward yourself when it's done. ")
+
+def make_handler(token_delay):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send_json(200, {'status': 'ok'})
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/completion':
+                self.send_json(404, {'error': 'not found'})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            words = REPLY.split(' ')[:request.get('n_predict', 128)]
+            tokens = [word + ' ' for word in words]
+
+            if not request.get('stream'):
+                time.sleep(token_delay * len(tokens))
+                self.send_json(200, {'content': ''.join(tokens), 'stop': True})
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for token in tokens:
+                time.sleep(token_delay)
+                self.wfile.write(f"data: {json.dumps({'content': token, 'stop': False})}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(f"data: {json.dumps({'content': '', 'stop': True})}\n\n".encode())
+            self.close_connection = True
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--token-delay', type=float, default=0.0, help='seconds per generated token')
+    parser.add_argument('--startup-delay', type=float, default=0.0, help='seconds spent "loading the model"')
+    parser.add_argument('-m', '--model', help='ignored')
+    parser.add_argument('-t', '--threads', help='ignored')
+    args, _ = parser.parse_known_args()
+
+    time.sleep(args.startup_delay)
+    ThreadingHTTPServer((args.host, args.port), make_handler(args.token_delay)).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Cold-start import benchmark for the Netlify function and the Flask server.
+
+Imports each entry module in a fresh interpreter under `python -X importtime`,
+reports the median cumulative import time and the slowest imports, and exits
+non-zero when a module goes over its budget or eagerly imports a provider SDK.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 10 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (directory to import from, module, import-time budget in milliseconds)
+TARGETS = {
+    'netlify handler': (os.path.join(ROOT, 'netlify', 'functions'), 'get_motivation',
+                        float(os.getenv('NETLIFY_IMPORT_BUDGET_MS', 300))),
+    'flask server': (ROOT, 'motivation_bot',
+                     float(os.getenv('FLASK_IMPORT_BUDGET_MS', 600)))
+}
+
+# Modules that must only be imported when a request needs them
+LAZY_MODULES = ('openai', 'google.generativeai', 'huggingface_hub', 'markdown')
+
+def import_times(directory, module):
+    """Import the module in a fresh interpreter and return {imported: cumulative_us}.
+
+    Only the target module and the imports it triggered are included, not the
+    interpreter's own startup imports.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=directory, capture_output=True, text=True,
+        env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    # Nested imports are indented and reported before the module that triggered
+    # them, so the target's imports are the lines since the previous top-level one
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        if name.strip() == name[1:]:
+            if name.strip() == module:
+                times[module] = int(cumulative_us)
+                break
+            times = {}
+        else:
+            times[name.strip()] = int(cumulative_us)
+    return times
+
+def benchmark(name, directory, module, budget_ms, runs, top):
+    runs_times = [import_times(directory, module) for _ in range(runs)]
+    median_ms = statistics.median(times[module] for times in runs_times) / 1000
+    status = 'OK' if median_ms <= budget_ms else 'OVER BUDGET'
+    print(f"{name}: {module} imports in {median_ms:.1f} ms (median of {runs}), budget {budget_ms:.0f} ms [{status}]")
+
+    slowest = sorted(runs_times[-1].items(), key=lambda item: item[1], reverse=True)
+    for imported, cumulative_us in slowest[1:top + 1]:
+        print(f"    {cumulative_us / 1000:8.1f} ms  {imported}")
+
+    eager = [lazy for lazy in LAZY_MODULES if lazy in runs_times[-1]]
+    if eager:
+        print(f"    imported eagerly: {', '.join(eager)}")
+    return median_ms <= budget_ms and not eager
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per target')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    parser.add_argument('--target', choices=TARGETS, action='append', help='only benchmark these targets')
+    args = parser.parse_args()
+
+    ok = True
+    for name in args.target or TARGETS:
+        directory, module, budget_ms = TARGETS[name]
+        try:
+            ok = benchmark(name, directory, module, budget_ms, args.runs, args.top) and ok
+        except RuntimeError as e:
+            print(f"{name}: {e}")
+            ok = False
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
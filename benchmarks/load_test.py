@@ -0,0 +1,211 @@
+"""Throughput and latency benchmark for the Flask server and the Netlify handler.
+
+Starts mock Perplexity, Mistral and OpenAI servers (see mock_providers.py),
+points the app at them through the *_BASE_URL settings, then drives
+/get_motivation (Flask, over HTTP) or handler() (Netlify, called in-process) at
+each concurrency level and reports requests/sec and p50/p95/p99 latency. No
+real provider is called and no API key is needed.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --target netlify --provider mistral --concurrency 1,16,64 --requests 500
+    python benchmarks/load_test.py --stream --latency lognormal:1.0,0.6 --error-rate 0.05 --json-out bench_output.txt
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_providers import MockProviderServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Providers each target can route to the mock servers
+TARGET_PROVIDERS = {
+    'flask': ('perplexity', 'openai', 'mistral'),
+    'netlify': ('perplexity', 'openai', 'mistral')
+}
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+def start_mocks(args):
+    mocks = {
+        name: MockProviderServer(name, args.latency, args.error_rate, args.token_delay).start()
+        for name in ('perplexity', 'mistral', 'openai')
+    }
+    os.environ['PERPLEXITY_BASE_URL'] = mocks['perplexity'].url
+    os.environ['MISTRAL_BASE_URL'] = mocks['mistral'].url + '/v1'
+    os.environ['OPENAI_BASE_URL'] = mocks['openai'].url + '/v1'
+    if not args.cache:
+        os.environ['RESPONSE_CACHE'] = 'off'
+    # No history fact calls to the real providers, and no cache or fact
+    # files shared with a dev server or an earlier run
+    os.environ['HISTORY_FACTS'] = 'off'
+    state_dir = tempfile.mkdtemp(prefix='motivation_load_test_')
+    atexit.register(shutil.rmtree, state_dir, ignore_errors=True)
+    os.environ['HISTORY_FACTS_PATH'] = os.path.join(state_dir, 'history_facts.json')
+    os.environ['RESPONSE_CACHE_PATH'] = os.path.join(state_dir, 'cache.sqlite3')
+    return mocks
+
+class FlaskTarget:
+    """Serves motivation_bot's app on an ephemeral port and calls it over HTTP"""
+
+    def __init__(self):
+        sys.path.insert(0, ROOT)
+        import requests
+        from werkzeug.serving import make_server
+        import motivation_bot
+
+        self._requests = requests
+        self._local = threading.local()
+        self._server = make_server('127.0.0.1', 0, motivation_bot.app, threaded=True)
+        threading.Thread(target=self._server.serve_forever, name='flask-under-test', daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._server.server_port}/get_motivation"
+
+    def call(self, text, provider, stream):
+        """Return (ok, seconds to first byte of content)"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        start = time.perf_counter()
+        body = {'text': text, 'provider': provider, 'api_key': 'mock-key', 'stream': stream}
+        with session.post(self.url, json=body, stream=stream) as response:
+            if not stream:
+                text = response.json().get('text', '')
+                return response.ok and not text.startswith(('Error', 'HTTP error')), time.perf_counter() - start
+            first_token = None
+            ok = response.ok
+            for line in response.iter_lines(decode_unicode=True):
+                if first_token is None and line.startswith('data:'):
+                    first_token = time.perf_counter() - start
+                if line.startswith('data:') and '"error"' in line:
+                    ok = False
+            return ok, first_token or time.perf_counter() - start
+
+    def close(self):
+        self._server.shutdown()
+
+class NetlifyTarget:
+    """Calls the Netlify function's handler() directly, as a warm instance would"""
+
+    def __init__(self):
+        sys.path.insert(0, os.path.join(ROOT, 'netlify', 'functions'))
+        import get_motivation
+        self._handler = get_motivation.handler
+
+    def call(self, text, provider, stream):
+        event = {'body': json.dumps({'text': text, 'provider': provider, 'apiKey': 'mock-key', 'stream': stream})}
+        start = time.perf_counter()
+        response = self._handler(event, None)
+        elapsed = time.perf_counter() - start
+        if response['statusCode'] != 200:
+            return False, elapsed
+        if stream:
+            return '"error"' not in response['body'], elapsed
+        text = json.loads(response['body']).get('text', '')
+        return not text.startswith(('Error', 'HTTP error')), elapsed
+
+    def close(self):
+        pass
+
+def run_level(name, target, provider, concurrency, requests, stream):
+    latencies = []
+    first_tokens = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(index):
+        nonlocal errors
+        # Distinct inputs so the cache and request coalescing don't collapse the load.
+        # Both targets run motivation_core in this process and share its cache,
+        # so the target is part of the input too.
+        text = f"Load test request {name}-{concurrency}-{index}: I can't get motivated to study"
+        start = time.perf_counter()
+        try:
+            ok, first_token = target.call(text, provider, stream)
+        except Exception:
+            ok, first_token = False, None
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if first_token is not None:
+                first_tokens.append(first_token)
+            errors += not ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    first_tokens.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': errors,
+        'rps': requests / wall,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'mean': statistics.fmean(latencies),
+        'ttft_p50': percentile(first_tokens, 0.50)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=['flask', 'netlify', 'both'], default='both')
+    parser.add_argument('--provider', choices=['perplexity', 'openai', 'mistral'], default='perplexity')
+    parser.add_argument('--concurrency', default='1,4,16,64', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200, help='requests per concurrency level')
+    parser.add_argument('--stream', action='store_true', help='use the streaming mode and report time to first token')
+    parser.add_argument('--latency', default='lognormal:0.2,0.4', help="mock latency: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of mock responses that fail with a 500')
+    parser.add_argument('--token-delay', type=float, default=0.005, help='seconds between streamed mock tokens')
+    parser.add_argument('--cache', action='store_true', help='leave the response cache on')
+    parser.add_argument('--log-level', default='WARNING', help='log level for the app while under load')
+    parser.add_argument('--json-out', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    mocks = start_mocks(args)
+    levels = [int(level) for level in args.concurrency.split(',')]
+    targets = ['flask', 'netlify'] if args.target == 'both' else [args.target]
+
+    results = []
+    print(f"{'target':8} {'conc':>5} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          + (f" {'ttft p50':>9}" if args.stream else ''))
+    for name in targets:
+        if args.provider not in TARGET_PROVIDERS[name]:
+            print(f"{name:8} skipped: no {args.provider} provider")
+            continue
+        target = FlaskTarget() if name == 'flask' else NetlifyTarget()
+        logging.getLogger().setLevel(args.log_level)
+        # werkzeug sets its own level when the server starts, overriding the root's
+        logging.getLogger('werkzeug').setLevel(args.log_level)
+        try:
+            for level in levels:
+                result = {'target': name, 'provider': args.provider, 'stream': args.stream, **run_level(name, target, args.provider, level, args.requests, args.stream)}
+                results.append(result)
+                print(f"{name:8} {level:5d} {result['requests']:6d} {result['errors']:6d} {result['rps']:8.1f} "
+                      f"{result['p50'] * 1000:8.1f} {result['p95'] * 1000:8.1f} {result['p99'] * 1000:8.1f}"
+                      + (f" {result['ttft_p50'] * 1000:9.1f}" if args.stream else ''))
+        finally:
+            target.close()
+
+    for mock in mocks.values():
+        mock.stop()
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Local stand-ins for the Perplexity, Mistral and OpenAI chat completions APIs.
+
+Each server answers POST .../chat/completions in the OpenAI-compatible format
+all three providers share, streaming or not, after a latency drawn from a
+configurable distribution and with a configurable error rate. Point the app at
+one with PERPLEXITY_BASE_URL, MISTRAL_BASE_URL or OPENAI_BASE_URL.
+
+    python benchmarks/mock_providers.py --port 9001 --latency lognormal:0.8,0.5 --error-rate 0.02
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = ("**You can do this!** Motivation follows action, not the other way round [1]. "
+         "Here are three steps for today:\n\n1. Pick the smallest task on your list.\n"
+         "2. Work on it for ten minutes [2].\n3. Take a short break and celebrate the progress.")
+
+def parse_latency(spec):
+    """Turn 'fixed:S', 'uniform:LOW,HIGH' or 'lognormal:MEDIAN,SIGMA' (seconds) into a sampler"""
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',')] if params else []
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda: median * random.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+class MockProviderServer:
+    """A chat completions stand-in running on a background thread"""
+
+    def __init__(self, name, latency='fixed:0', error_rate=0.0, token_delay=0.0, host='127.0.0.1', port=0):
+        self.name = name
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.token_delay = token_delay
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f'mock-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, failed):
+        with self._lock:
+            self.requests += 1
+            self.errors += failed
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not self.path.endswith('/chat/completions'):
+                    self.send_json(404, {'error': {'message': f"No route for {self.path}"}})
+                    return
+
+                failed = random.random() < mock.error_rate
+                mock._count(failed)
+                time.sleep(mock.sample_latency())
+                if failed:
+                    self.send_json(500, {'error': {'message': f"Mock {mock.name} error", 'type': 'server_error'}})
+                    return
+
+                completion_id = f"mock-{time.time_ns()}"
+                model = request.get('model', 'mock')
+                # One word per token, cut off at max_tokens like a real completion
+                reply = ' '.join(REPLY.split(' ')[:request.get('max_tokens', 1000)])
+                if request.get('stream'):
+                    self.stream_reply(completion_id, model, reply)
+                    return
+                self.send_json(200, {
+                    'id': completion_id,
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': reply},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {'prompt_tokens': 100, 'completion_tokens': len(reply.split()), 'total_tokens': 100 + len(reply.split())}
+                })
+
+            def stream_reply(self, completion_id, model, reply):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for token in (word + ' ' for word in reply.split(' ')):
+                    time.sleep(mock.token_delay)
+                    self.send_event({
+                        'id': completion_id,
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': model,
+                        'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+                    })
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+            def send_event(self, payload):
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+                self.wfile.flush()
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--name', default='mock')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9001)
+    parser.add_argument('--latency', default='lognormal:0.5,0.4', help="fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--token-delay', type=float, default=0.01, help='seconds between streamed tokens')
+    args = parser.parse_args()
+
+    server = MockProviderServer(args.name, args.latency, args.error_rate, args.token_delay, args.host, args.port).start()
+    print(f"Mock {args.name} provider listening on {server.url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Warm pool of llama.cpp server processes for the 'local' provider.
+
+Each worker is a long-lived `llama-server` subprocess with the model loaded
+once, listening on its own localhost port. Prompts queue for the next idle
+worker, so a model is never reloaded per request the way `run_llm.sh` does.
+
+Any executable that accepts the same command line and serves `/health` and
+`/completion` can stand in for llama-server, e.g. benchmarks/fake_llama_server.py.
+"""
+import http.client
+import json
+import logging
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LOCAL_LLM_SERVER = os.getenv('LOCAL_LLM_SERVER', 'llama-server')
+LOCAL_LLM_MODEL = os.getenv('LOCAL_LLM_MODEL', 'mistral-7b-instruct-v0.1.Q4_K_M.gguf')
+LOCAL_LLM_WORKERS = int(os.getenv('LOCAL_LLM_WORKERS', 1))
+LOCAL_LLM_THREADS = int(os.getenv('LOCAL_LLM_THREADS', max((os.cpu_count() or 1) // LOCAL_LLM_WORKERS, 1)))
+LOCAL_LLM_BASE_PORT = int(os.getenv('LOCAL_LLM_BASE_PORT', 8090))
+LOCAL_LLM_COMMAND = os.getenv(
+    'LOCAL_LLM_COMMAND',
+    '{server} -m {model} --host 127.0.0.1 --port {port} -t {threads}'
+)
+# Mistral instruct format, matching the model run_llm.sh uses
+LOCAL_LLM_PROMPT_TEMPLATE = os.getenv('LOCAL_LLM_PROMPT_TEMPLATE', '[INST] {prompt} [/INST]')
+LOCAL_LLM_STARTUP_TIMEOUT = float(os.getenv('LOCAL_LLM_STARTUP_TIMEOUT', 300))
+LOCAL_LLM_QUEUE_TIMEOUT = float(os.getenv('LOCAL_LLM_QUEUE_TIMEOUT', 120))
+LOCAL_LLM_REQUEST_TIMEOUT = float(os.getenv('LOCAL_LLM_REQUEST_TIMEOUT', 300))
+# A worker that fails to restart is retried after this delay, doubling up to the max
+LOCAL_LLM_RESTART_BACKOFF = float(os.getenv('LOCAL_LLM_RESTART_BACKOFF', 1))
+LOCAL_LLM_RESTART_BACKOFF_MAX = float(os.getenv('LOCAL_LLM_RESTART_BACKOFF_MAX', 60))
+
+class LlamaWorker:
+    """One llama-server subprocess and its usage counters"""
+
+    def __init__(self, index, port, command):
+        self.index = index
+        self.port = port
+        self.command = command
+        self.process = None
+        self.started_at = None
+        self.busy_since = None
+        self.busy_seconds = 0.0
+        self.requests = 0
+
+    def start(self):
+        args = shlex.split(self.command.format(
+            server=LOCAL_LLM_SERVER, model=LOCAL_LLM_MODEL, port=self.port, threads=LOCAL_LLM_THREADS))
+        logger.info(f"Starting local LLM worker {self.index}: {' '.join(args)}")
+        self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.started_at = time.monotonic()
+
+    def wait_ready(self, timeout):
+        """Block until /health reports the model is loaded"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.alive():
+                raise RuntimeError(f"Local LLM worker {self.index} exited with code {self.process.returncode}")
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+                connection.request('GET', '/health')
+                status = connection.getresponse().status
+                connection.close()
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError(f"Local LLM worker {self.index} not ready after {timeout:g}s")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def complete(self, prompt, max_tokens):
+        """Yield generated text from the worker's streaming /completion endpoint"""
+        body = json.dumps({
+            'prompt': LOCAL_LLM_PROMPT_TEMPLATE.format(prompt=prompt),
+            'n_predict': max_tokens,
+            'stream': True
+        })
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=LOCAL_LLM_REQUEST_TIMEOUT)
+        try:
+            connection.request('POST', '/completion', body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"Local LLM worker {self.index} returned {response.status}: {response.read().decode()}")
+            for line in response:
+                line = line.decode().strip()
+                if not line.startswith('data:'):
+                    continue
+                event = json.loads(line[len('data:'):])
+                if event.get('content'):
+                    yield event['content']
+                if event.get('stop'):
+                    break
+        finally:
+            # Closing mid-stream makes llama-server stop generating for us
+            connection.close()
+
+    def stats(self):
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        busy_seconds = self.busy_seconds
+        if self.busy_since is not None:
+            busy_seconds += time.monotonic() - self.busy_since
+        return {
+            'index': self.index,
+            'pid': self.process.pid if self.process else None,
+            'alive': self.alive(),
+            'busy': self.busy_since is not None,
+            'requests': self.requests,
+            'utilization': busy_seconds / uptime if uptime else 0.0
+        }
+
+class LocalLLMPool:
+    """Queues prompts across a fixed set of warm llama-server workers"""
+
+    def __init__(self, workers=LOCAL_LLM_WORKERS, base_port=LOCAL_LLM_BASE_PORT, command=LOCAL_LLM_COMMAND):
+        self.workers = [LlamaWorker(index, base_port + index, command) for index in range(workers)]
+        self._idle = queue.Queue()
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def start(self, timeout=LOCAL_LLM_STARTUP_TIMEOUT):
+        # Start every worker before waiting so the models load in parallel
+        for worker in self.workers:
+            worker.start()
+        for worker in self.workers:
+            worker.wait_ready(timeout)
+            self._idle.put(worker)
+
+    def close(self):
+        self._closed.set()
+        for worker in self.workers:
+            worker.stop()
+
+    def generate(self, prompt, max_tokens):
+        return ''.join(self.stream(prompt, max_tokens))
+
+    def stream(self, prompt, max_tokens):
+        """Yield generated text from the next idle worker, waiting in line for one if needed"""
+        worker = self._checkout()
+        worker.busy_since = time.monotonic()
+        try:
+            yield from worker.complete(prompt, max_tokens)
+        finally:
+            worker.busy_seconds += time.monotonic() - worker.busy_since
+            worker.busy_since = None
+            worker.requests += 1
+            self._release(worker)
+
+    def _checkout(self):
+        deadline = time.monotonic() + LOCAL_LLM_QUEUE_TIMEOUT
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                try:
+                    worker = self._idle.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    raise RuntimeError(f"No local LLM worker free after {LOCAL_LLM_QUEUE_TIMEOUT:g}s")
+                if worker.alive():
+                    return worker
+                # Died while idle; bring it back and wait for another
+                self._restart(worker)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def _release(self, worker):
+        if worker.alive():
+            self._idle.put(worker)
+        else:
+            self._restart(worker)
+
+    def _restart(self, worker):
+        def restart():
+            logger.error(f"Local LLM worker {worker.index} died, restarting it")
+            delay = LOCAL_LLM_RESTART_BACKOFF
+            while not self._closed.is_set():
+                try:
+                    worker.start()
+                    worker.wait_ready(LOCAL_LLM_STARTUP_TIMEOUT)
+                except (RuntimeError, OSError) as e:
+                    # OSError covers a missing or unrunnable server binary; stop
+                    # any process that did start so it isn't left holding the port
+                    worker.stop()
+                    logger.error(f"Failed to restart local LLM worker {worker.index}, retrying in {delay:g}s: {str(e)}")
+                    if self._closed.wait(delay):
+                        return
+                    delay = min(delay * 2, LOCAL_LLM_RESTART_BACKOFF_MAX)
+                    continue
+                if self._closed.is_set():
+                    # The pool closed while this worker was starting
+                    worker.stop()
+                    return
+                self._idle.put(worker)
+                return
+
+        threading.Thread(target=restart, name=f'local-llm-restart-{worker.index}', daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            waiting = self._waiting
+        return {
+            'queue_depth': waiting,
+            'idle_workers': self._idle.qsize(),
+            'workers': [worker.stats() for worker in self.workers]
+        }
@@ -1,21 +1,30 @@
 import os
-from flask import Flask, request, jsonify, make_response
+import sys
+import json
+import threading
+import time
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context, g
 from flask_cors import CORS
-import requests
-import markdown
-from dotenv import load_dotenv
-import google.generativeai as genai
-from openai import OpenAI
-from huggingface_hub import InferenceClient
 import logging
-import re
+import atexit
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# The code shared with the Netlify functions lives next to them so it is
+# deployed with them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'netlify', 'functions'))
+
+from motivation_core import (
+    REFERENCE_MARKER, DEFAULT_API_KEYS, BATCH_MAX_ITEMS, metrics, current_timings,
+    timed_stage, log_request_sample, circuit_breakers, hedge_delay, response_cache, history_facts_enabled,
+    get_motivational_response, get_hedged_response, stream_motivational_response, sse_events,
+    normalize_batch_items, iter_batch, refresh_history_facts, warn_if_history_facts_unavailable,
+    register_local_provider
+)
+import local_llm
+from local_llm import LocalLLMPool
 
 app = Flask(__name__)
 
@@ -30,13 +39,17 @@ CORS(app, resources={
 })
 
 @app.before_request
-def log_request_info():
-    logger.debug('Headers: %s', request.headers)
-    logger.debug('Body: %s', request.get_data())
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    g.timings = {}
+    current_timings.set(g.timings)
+    log_request_sample(request.headers, request.get_json(silent=True))
 
 @app.after_request
 def after_request(response):
-    logger.debug('Response headers: %s', response.headers)
+    # A streamed body is generated after this hook, so timed_stream records it
+    if not response.is_streamed:
+        record_request_timing(response.status_code)
     response.headers.add('Access-Control-Allow-Origin', 'http://localhost:3000')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
@@ -49,62 +62,64 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 HUGGINGFACE_API_KEY = os.getenv('HUGGINGFACE_API_KEY')
 
-# Initialize clients
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-genai.configure(api_key=GOOGLE_API_KEY) if GOOGLE_API_KEY else None
-huggingface_client = InferenceClient(token=HUGGINGFACE_API_KEY) if HUGGINGFACE_API_KEY else None
-
-def get_motivational_response(user_input, provider):
-    """Get a motivational response from the selected LLM provider"""
-    prompt = f"""Please provide a motivational and actionable response to the following situation, limited to 500 words:
-    {user_input}
-    
-    Requirements:
-    1. Be motivational and uplifting
-    2. Include specific, actionable steps
-    3. End with a fun "This Day in History" fact
-    4. Use markdown formatting for better readability
-    5. Keep the tone positive and encouraging
+DEFAULT_API_KEYS.update({
+    'perplexity': PERPLEXITY_API_KEY,
+    'openai': OPENAI_API_KEY,
+    'gemini': GOOGLE_API_KEY,
+    'huggingface': HUGGINGFACE_API_KEY
+})
+
+# Start the local llama.cpp workers with the server instead of on the first 'local' request
+LOCAL_LLM_PRELOAD = os.getenv('LOCAL_LLM_PRELOAD', '') == '1'
+
+local_llm_pool = None
+local_llm_pool_lock = threading.Lock()
+
+def get_local_llm_pool():
+    """Get the warm llama.cpp worker pool, starting it on first use"""
+    global local_llm_pool
+    with local_llm_pool_lock:
+        if local_llm_pool is None:
+            pool = LocalLLMPool()
+            try:
+                pool.start()
+            except Exception:
+                pool.close()
+                raise
+            atexit.register(pool.close)
+            local_llm_pool = pool
+        return local_llm_pool
+
+register_local_provider('local', os.path.basename(local_llm.LOCAL_LLM_MODEL), get_local_llm_pool)
+warn_if_history_facts_unavailable()
+
+def record_request_timing(status):
+    """Count the request and log its stage timings as one structured line"""
+    if 'request_start' not in g:
+        return
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    metrics.inc('motivation_requests_total', endpoint=endpoint, status=status)
+    metrics.observe('motivation_request_seconds', elapsed, endpoint=endpoint)
+    logger.info(json.dumps({
+        'event': 'request_timing',
+        'endpoint': endpoint,
+        'status': status,
+        'seconds': round(elapsed, 4),
+        'stages': {stage: round(seconds, 4) for stage, seconds in g.timings.items()}
+    }))
+
+def timed_stream(body):
+    """Stream a response body, recording the request's timing once it has been sent (or abandoned).
+
+    Wrap in stream_with_context, which keeps the request context around the
+    generator so the stages it runs are added to this request's timings.
     """
-    
+    current_timings.set(g.timings)
     try:
-        if provider == 'perplexity':
-            headers = {
-                "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": "sonar",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1000
-            }
-            response = requests.post("https://api.perplexity.ai/chat/completions", headers=headers, json=data)
-            response.raise_for_status()
-            return response.json()['choices'][0]['message']['content']
-        elif provider == 'openai':
-            response = openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000
-            )
-            return response.choices[0].message.content
-        elif provider == 'gemini':
-            model = genai.GenerativeModel('gemini-pro')
-            response = model.generate_content(prompt)
-            return response.text
-        elif provider == 'huggingface':
-            response = huggingface_client.text_generation(
-                prompt,
-                max_new_tokens=1000,
-                temperature=0.7,
-                return_full_text=False
-            )
-            return response
-        else:
-            return "Invalid provider selected"
-    except Exception as e:
-        logger.error(f"Error getting response from {provider}: {str(e)}")
-        return f"Error getting response from {provider}: {str(e)}"
+        yield from body
+    finally:
+        record_request_timing(200)
 
 @app.route('/get_motivation', methods=['POST', 'OPTIONS'])
 def get_motivation():
@@ -116,41 +131,98 @@ def get_motivation():
         response.headers.add('Access-Control-Allow-Credentials', 'true')
         return response
         
-    user_input = request.json.get('text', '')
-    provider = request.json.get('provider', 'perplexity')
-    api_key = request.json.get('api_key', '')
-
-    # Set the API key for the selected provider
-    if provider == 'perplexity':
-        global PERPLEXITY_API_KEY
-        PERPLEXITY_API_KEY = api_key
-    elif provider == 'openai':
-        global OPENAI_API_KEY
-        OPENAI_API_KEY = api_key
-        global openai_client
-        openai_client = OpenAI(api_key=api_key)
-    elif provider == 'gemini':
-        global GOOGLE_API_KEY
-        GOOGLE_API_KEY = api_key
-        genai.configure(api_key=api_key)
-    elif provider == 'huggingface':
-        global HUGGINGFACE_API_KEY
-        HUGGINGFACE_API_KEY = api_key
-        global huggingface_client
-        huggingface_client = InferenceClient(token=api_key)
+    with timed_stage('parse'):
+        body = request.json
+        user_input = body.get('text', '')
+        provider = body.get('provider', 'perplexity')
+        api_key = body.get('api_key', '')
+
+    # An ordered 'providers' list (with per-provider 'api_keys') enables
+    # hedging; a stream goes to the first provider whose breaker is closed
+    providers = body.get('providers')
+    if providers and body.get('stream', False):
+        provider = next((p for p in providers if p in circuit_breakers and circuit_breakers[p].state() == 'closed'), providers[0])
+        api_key = body.get('api_keys', {}).get(provider, api_key)
+
+    if body.get('stream', False):
+        events = sse_events(stream_motivational_response(user_input, provider, api_key), provider)
+        return Response(stream_with_context(timed_stream(events)), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
 
     try:
-        response = get_motivational_response(user_input, provider)
+        if providers:
+            response, provider = get_hedged_response(user_input, providers, body.get('api_keys', {}))
+        else:
+            response = get_motivational_response(user_input, provider, api_key)
     except Exception as e:
         response = f"Error: {str(e)}"
 
-    # Remove reference markers like [1], [2], etc.
-    response = re.sub(r'\[\d+\]', '', response)
+    with timed_stage('post_processing'):
+        # Remove reference markers like [1], [2], etc.
+        response = REFERENCE_MARKER.sub('', response)
+
+        # No audio generation here!
+        return jsonify({
+            'text': response,
+            'provider': provider
+        })
+
+@app.route('/get_motivations', methods=['POST'])
+def get_motivations():
+    """Batch version of /get_motivation, streaming one JSON line per item as it completes"""
+    try:
+        items = normalize_batch_items(request.get_json(silent=True), 'api_key')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f"Batch too large: {len(items)} items, the limit is {BATCH_MAX_ITEMS}"}), 400
+
+    lines = (json.dumps(result) + '\n' for result in iter_batch(items, 'api_key'))
+    return Response(stream_with_context(timed_stream(lines)), mimetype='application/x-ndjson')
 
-    # No audio generation here!
+@app.route('/provider_health', methods=['GET'])
+def provider_health():
     return jsonify({
-        'text': response
+        provider: {
+            'state': breaker.state(),
+            'p95_latency': breaker.latency_percentile(0.95),
+            'hedge_delay': hedge_delay(provider)
+        }
+        for provider, breaker in circuit_breakers.items()
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request, stage and provider metrics in the Prometheus text format"""
+    breaker_states = {'closed': 0, 'half_open': 1, 'open': 2}
+    gauges = [
+        ('motivation_circuit_breaker_state', {'provider': provider}, breaker_states[breaker.state()])
+        for provider, breaker in circuit_breakers.items()
+    ]
+    if local_llm_pool is not None:
+        gauges.append(('motivation_local_llm_queue_depth', {}, local_llm_pool.stats()['queue_depth']))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/local_llm_stats', methods=['GET'])
+def local_llm_stats():
+    if local_llm_pool is None:
+        return jsonify({'started': False})
+    return jsonify({'started': True, **local_llm_pool.stats()})
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    if response_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **response_cache.stats()})
+
 if __name__ == '__main__':
+    # The debug reloader also runs this block in its watcher process, which
+    # never serves requests, so only the serving process starts the workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        if LOCAL_LLM_PRELOAD:
+            threading.Thread(target=get_local_llm_pool, name='local-llm-preload', daemon=True).start()
+        if history_facts_enabled():
+            threading.Thread(target=refresh_history_facts, name='history-facts', daemon=True).start()
     app.run(debug=True, port=5001)
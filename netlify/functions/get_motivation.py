@@ -1,20 +1,23 @@
 import os
 import json
-import requests
-import markdown
-import re
-from dotenv import load_dotenv
-import google.generativeai as genai
-from openai import OpenAI
-from huggingface_hub import InferenceClient
+import time
 import logging
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# The functions cache responses in /tmp by default. This has to be set before
+# motivation_core reads its settings on import.
+os.environ.setdefault('RESPONSE_CACHE', 'disk')
+
+from motivation_core import (
+    REFERENCE_MARKER, metrics, current_timings, timed_stage, log_request_sample, circuit_breakers,
+    response_cache, get_motivational_response, get_hedged_response, stream_motivational_response, sse_events,
+    warn_if_history_facts_unavailable
+)
+
+warn_if_history_facts_unavailable()
 
 # API configurations (These will now be passed dynamically)
 # PERPLEXITY_API_KEY = os.getenv('PERPLEXITY_API_KEY')
@@ -27,93 +30,80 @@ load_dotenv()
 # genai.configure(api_key=GOOGLE_API_KEY) if GOOGLE_API_KEY else None
 # huggingface_client = InferenceClient(token=HUGGINGFACE_API_KEY) if HUGGINGFACE_API_KEY else None
 
-def get_motivational_response(user_input, provider, api_key):
-    """Get a motivational response from the selected LLM provider"""
-    prompt = f"""Please provide a motivational and actionable response to the following situation, limited to 500 words:
-    {user_input}
-    
-    Requirements:
-    1. Be motivational and uplifting
-    2. Include specific, actionable steps
-    3. End with a fun "This Day in History" fact
-    4. Use markdown formatting for better readability
-    5. Keep the tone positive and encouraging
-    """
-    
+def log_invocation(function, response, timings, elapsed, provider=None):
+    """Log one structured line per invocation; with no /metrics endpoint here, it also carries the instance's counters"""
+    line = {
+        'event': 'invocation',
+        'function': function,
+        'provider': provider,
+        'status': response['statusCode'],
+        'seconds': round(elapsed, 4),
+        'stages': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        'provider_calls': metrics.counter_values('motivation_provider_calls_total'),
+        'breakers': {name: breaker.state() for name, breaker in circuit_breakers.items() if breaker.state() != 'closed'}
+    }
+    if response_cache is not None:
+        line['cache'] = response_cache.stats()
+    logger.info(json.dumps(line))
+
+def timed_invocation(function, handle, event):
+    """Run handle(event) -> (response, provider) with stage timing and log the invocation"""
+    timings = {}
+    token = current_timings.set(timings)
+    start = time.perf_counter()
     try:
-        if provider == 'perplexity':
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": "sonar",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1000
-            }
-            logger.debug(f"Perplexity API request headers: {headers}")
-            logger.debug(f"Perplexity API request data: {data}")
-            response = requests.post("https://api.perplexity.ai/chat/completions", headers=headers, json=data)
-            response.raise_for_status()
-            logger.debug(f"Perplexity API response: {response.json()}")
-            return response.json()['choices'][0]['message']['content']
-        elif provider == 'openai':
-            openai_client = OpenAI(api_key=api_key)
-            response = openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1000
-            )
-            return response.choices[0].message.content
-        elif provider == 'mistral':
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": "mistral-tiny", # or appropriate model for mistral
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1000
-            }
-            response = requests.post("https://api.mistral.ai/v1/chat/completions", headers=headers, json=data)
-            response.raise_for_status()
-            return response.json()['choices'][0]['message']['content']
-        elif provider == 'gemini':
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-pro')
-            response = model.generate_content(prompt)
-            return response.text
-        elif provider == 'huggingface':
-            huggingface_client = InferenceClient(token=api_key)
-            response = huggingface_client.text_generation(
-                prompt,
-                max_new_tokens=1000,
-                temperature=0.7,
-                return_full_text=False
-            )
-            return response
-        else:
-            return "Invalid provider selected"
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP error for {provider}: {http_err}")
-        logger.error(f"Response status code: {http_err.response.status_code}")
-        logger.error(f"Response body: {http_err.response.text}")
-        return f"HTTP error from {provider}: {http_err.response.text}"
-    except Exception as e:
-        logger.error(f"Error getting response from {provider}: {str(e)}")
-        return f"Error getting response from {provider}: {str(e)}"
+        response, provider = handle(event)
+    finally:
+        current_timings.reset(token)
+    elapsed = time.perf_counter() - start
+    metrics.inc('motivation_requests_total', endpoint=function, status=response['statusCode'])
+    metrics.observe('motivation_request_seconds', elapsed, endpoint=function)
+    log_invocation(function, response, timings, elapsed, provider)
+    return response
 
 def handler(event, context):
+    return timed_invocation('get_motivation', handle_request, event)
+
+def handle_request(event):
+    provider = None
     try:
-        body = json.loads(event['body'])
-        user_input = body.get('text', '')
-        provider = body.get('provider', 'perplexity')
-        api_key = body.get('apiKey', '')
-        logger.debug(f"Received request for provider: {provider}, API Key (first 5 chars): {api_key[:5]}...")
-        logger.debug(f"User input: {user_input}")
+        with timed_stage('parse'):
+            body = json.loads(event['body'])
+            user_input = body.get('text', '')
+            provider = body.get('provider', 'perplexity')
+            api_key = body.get('apiKey', '')
+        log_request_sample(event.get('headers') or {}, body)
+
+        # An ordered 'providers' list (with per-provider 'apiKeys') enables
+        # hedging; a stream goes to the first provider whose breaker is closed
+        providers = body.get('providers')
+        if providers and body.get('stream', False):
+            provider = next((p for p in providers if p in circuit_breakers and circuit_breakers[p].state() == 'closed'), providers[0])
+            api_key = body.get('apiKeys', {}).get(provider, api_key)
 
-        response_text = get_motivational_response(user_input, provider, api_key)
-        response_text = re.sub(r'\[\d+\]', '', response_text) # Remove reference markers
+        if body.get('stream', False):
+            # Lambda-style handlers return a buffered body, so the events are
+            # collected here; the format matches the Flask server's stream.
+            events = sse_events(stream_motivational_response(user_input, provider, api_key), provider)
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'text/event-stream',
+                    'Cache-Control': 'no-cache',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type'
+                },
+                'body': ''.join(events)
+            }, provider
+
+        if providers:
+            response_text, provider = get_hedged_response(user_input, providers, body.get('apiKeys', {}))
+        else:
+            response_text = get_motivational_response(user_input, provider, api_key)
+        with timed_stage('post_processing'):
+            response_text = REFERENCE_MARKER.sub('', response_text) # Remove reference markers
+            response_body = json.dumps({'text': response_text, 'provider': provider})
 
         return {
             'statusCode': 200,
@@ -123,8 +113,8 @@ def handler(event, context):
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type'
             },
-            'body': json.dumps({'text': response_text})
-        }
+            'body': response_body
+        }, provider
     except Exception as e:
         logger.error(f"Error in Netlify function: {str(e)}")
         return {
@@ -136,4 +126,4 @@ def handler(event, context):
                 'Access-Control-Allow-Headers': 'Content-Type'
             },
             'body': json.dumps({'error': str(e)})
-        }
+        }, provider
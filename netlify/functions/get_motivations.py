@@ -0,0 +1,59 @@
+import os
+import json
+import logging
+from get_motivation import timed_invocation
+from motivation_core import BATCH_MAX_ITEMS, BATCH_PROVIDER_RATE, normalize_batch_items, iter_batch, timed_stage, log_request_sample
+
+logger = logging.getLogger(__name__)
+
+# Netlify stops a function after 10 seconds (26 if raised), and a batch
+# starts at most BATCH_PROVIDER_RATE calls per second per provider. The cap
+# leaves half the timeout for pacing the calls and half for the last ones to
+# answer, so an accepted batch can finish.
+NETLIFY_FUNCTION_TIMEOUT = float(os.getenv('NETLIFY_FUNCTION_TIMEOUT', 10))
+NETLIFY_BATCH_MAX_ITEMS = min(BATCH_MAX_ITEMS, int(os.getenv(
+    'NETLIFY_BATCH_MAX_ITEMS', max(int(BATCH_PROVIDER_RATE * NETLIFY_FUNCTION_TIMEOUT / 2), 1))))
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+def handler(event, context):
+    """Batch version of get_motivation: one JSON line per item, in completion order"""
+    return timed_invocation('get_motivations', handle_batch, event)
+
+def handle_batch(event):
+    try:
+        with timed_stage('parse'):
+            body = json.loads(event['body'])
+            items = normalize_batch_items(body, 'apiKey')
+        log_request_sample(event.get('headers') or {}, body)
+        if len(items) > NETLIFY_BATCH_MAX_ITEMS:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
+                'body': json.dumps({'error': f"Batch too large: {len(items)} items, the limit is {NETLIFY_BATCH_MAX_ITEMS}"})
+            }, body.get('provider')
+
+        lines = [json.dumps(result) for result in iter_batch(items, 'apiKey')]
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/x-ndjson', **CORS_HEADERS},
+            'body': '\n'.join(lines) + '\n'
+        }, body.get('provider')
+    except ValueError as e:
+        # Includes a body that isn't valid JSON
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
+            'body': json.dumps({'error': str(e)})
+        }, None
+    except Exception as e:
+        logger.error(f"Error in Netlify batch function: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
+            'body': json.dumps({'error': str(e)})
+        }, None
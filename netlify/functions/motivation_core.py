@@ -0,0 +1,1276 @@
+"""Provider calls, caching, hedging, batching and metrics shared by the Flask
+server (motivation_bot.py) and the Netlify functions.
+
+Settings are read from the environment (and .env) when the module is imported.
+"""
+import os
+import json
+import hashlib
+import threading
+import time
+import random
+import contextvars
+import functools
+import sqlite3
+import tempfile
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import nullcontext, contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+import re
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+PROVIDER_MODELS = {
+    'perplexity': 'sonar',
+    'openai': 'gpt-3.5-turbo',
+    'mistral': 'mistral-tiny', # or appropriate model for mistral
+    'gemini': 'gemini-pro',
+    'huggingface': None  # InferenceClient's recommended text-generation model
+}
+
+# Server-side keys used when a request doesn't bring its own. The Flask server
+# fills these in from its environment; the Netlify functions leave them empty.
+DEFAULT_API_KEYS = {}
+
+# Metrics and request logging settings. A sampled request is logged with its
+# API keys and auth headers redacted and its text truncated.
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv('REQUEST_LOG_SAMPLE_RATE', 0.01))
+REQUEST_LOG_MAX_TEXT = 200
+REDACTED_HEADERS = {'authorization', 'cookie', 'x-api-key'}
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metrics:
+    """Prometheus-style counters and histograms kept in process memory"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def counter_values(self, name):
+        """Current values of a counter as {"label=value,...": count}"""
+        with self._lock:
+            return {
+                ','.join(f'{k}={v}' for k, v in labels): value
+                for (counter, labels), value in self._counters.items() if counter == name
+            }
+
+    def render(self, gauges=()):
+        """Render in the Prometheus text exposition format; `gauges` are (name, labels, value) read at scrape time"""
+        def series(name, labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return name
+            return name + '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{series(name, labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f"{series(name + '_bucket', labels, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{series(name + '_bucket', labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{series(name + '_sum', labels)} {histogram['sum']}")
+                lines.append(f"{series(name + '_count', labels)} {histogram['count']}")
+        for name, labels, value in gauges:
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{series(name, sorted(labels.items()))} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(LATENCY_BUCKETS)
+
+# Stage timings of the request being handled, as {stage: seconds}
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+@contextmanager
+def timed_stage(stage):
+    """Time a stage of request handling into the metrics and the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def record_stage(stage, elapsed):
+    """Record a stage timed by the caller, for stages that timed_stage can't wrap"""
+    metrics.observe('motivation_stage_seconds', elapsed, stage=stage)
+    timings = current_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def redact_body(value):
+    """Copy of a request body with any *key* fields redacted and long text cut short"""
+    if isinstance(value, dict):
+        return {k: '[redacted]' if 'key' in k.lower() else redact_body(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact_body(item) for item in value]
+    if isinstance(value, str):
+        return value[:REQUEST_LOG_MAX_TEXT]
+    return value
+
+def redact_request(headers, body):
+    """A loggable copy of a request with credentials removed"""
+    headers = {
+        name: '[redacted]' if name.lower() in REDACTED_HEADERS else value
+        for name, value in headers.items()
+    }
+    return {'headers': headers, 'body': redact_body(body)}
+
+def log_request_sample(headers, body):
+    if random.random() < REQUEST_LOG_SAMPLE_RATE:
+        logger.info(json.dumps({'event': 'request_sample', **redact_request(headers, body)}, default=str))
+
+# Provider endpoints, overridable to point at local stand-ins such as the
+# benchmark mock servers
+PERPLEXITY_BASE_URL = os.getenv('PERPLEXITY_BASE_URL', 'https://api.perplexity.ai')
+MISTRAL_BASE_URL = os.getenv('MISTRAL_BASE_URL', 'https://api.mistral.ai/v1')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # None uses the SDK's default
+
+# Connection pool settings
+PROVIDER_TIMEOUT = float(os.getenv('PROVIDER_TIMEOUT', 30))
+CLIENT_POOL_SIZE = int(os.getenv('CLIENT_POOL_SIZE', 32))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 16))
+
+class ClientPool:
+    """Bounded LRU pool of provider clients keyed by (provider, hashed API key)"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, provider, api_key, factory):
+        key = (provider, hashlib.sha256((api_key or '').encode()).hexdigest())
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+        # Built outside the lock: a first use may import the provider SDK, which
+        # shouldn't hold up requests for other providers
+        client = factory(api_key)
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None:
+                self._clients.move_to_end(key)
+                return existing
+            self._clients[key] = client
+            # Evicted clients are not closed, another request may still be using them
+            if len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+            return client
+
+def create_http_session():
+    """Create a keep-alive session for the providers called over plain HTTP"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Provider SDKs are imported on first use, so a cold start only pays for the
+# provider a request actually needs
+
+def create_openai_client(api_key):
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, timeout=PROVIDER_TIMEOUT)
+
+def create_gemini_model(api_key):
+    import google.generativeai as genai
+    import google.ai.generativelanguage as glm
+    model = genai.GenerativeModel(PROVIDER_MODELS['gemini'])
+    # Give the model its own client so requests with different keys don't
+    # race on the process-wide genai.configure()
+    client = glm.GenerativeServiceClient(client_options={'api_key': api_key})
+    # GenerativeModel passes no timeout to its client, so bind one on
+    client.generate_content = functools.partial(client.generate_content, timeout=PROVIDER_TIMEOUT)
+    client.stream_generate_content = functools.partial(client.stream_generate_content, timeout=PROVIDER_TIMEOUT)
+    model._client = client
+    return model
+
+def create_huggingface_client(api_key):
+    from huggingface_hub import InferenceClient
+    return InferenceClient(token=api_key, timeout=PROVIDER_TIMEOUT)
+
+PROVIDER_CLIENT_FACTORIES = {
+    'openai': create_openai_client,
+    'gemini': create_gemini_model,
+    'huggingface': create_huggingface_client
+}
+
+# Shared across requests (and invocations of a warm function instance); the
+# API key is sent per request in the Authorization header
+http_session = create_http_session()
+client_pool = ClientPool(CLIENT_POOL_SIZE)
+
+# Providers served in-process, as {provider: get_backend}; the backend has
+# generate(prompt, max_tokens) and stream(prompt, max_tokens). See register_local_provider.
+LOCAL_BACKENDS = {}
+
+def get_client(provider, api_key):
+    """Get a pooled client for the provider, creating it on first use of the key"""
+    with timed_stage('client_acquisition'):
+        return client_pool.get(provider, api_key, PROVIDER_CLIENT_FACTORIES[provider])
+
+# Response cache settings. RESPONSE_CACHE is 'memory', 'disk' or 'off', and the
+# Netlify functions default it to 'disk'. Near-duplicate matching is off unless
+# RESPONSE_CACHE_SIMILARITY is set above 0: inputs a word apart can mean the
+# opposite ("I lost my job" / "I didn't lose my job") and would share a reply.
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'memory')
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'motivation_cache.sqlite3'))
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 24 * 60 * 60))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0))
+
+# MinHash signature layout: MINHASH_BANDS bands of MINHASH_ROWS values each
+MINHASH_BANDS = 16
+MINHASH_ROWS = 4
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_SEEDS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], 'big') % MINHASH_PRIME | 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], 'big') % MINHASH_PRIME)
+    for i in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+def normalize_input(user_input):
+    """Lowercase, drop punctuation and collapse whitespace so trivial edits share a key"""
+    return ' '.join(re.sub(r"[^\w\s]", '', user_input.lower()).split())
+
+def minhash_signature(text, shingle_size=4):
+    """MinHash signature over the character shingles of already-normalized text"""
+    shingles = {text[i:i + shingle_size] for i in range(max(len(text) - shingle_size + 1, 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') for s in shingles]
+    return [min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in MINHASH_SEEDS]
+
+def signature_bands(namespace, signature):
+    """Locality-sensitive hashing buckets: inputs sharing any band are candidates"""
+    return [
+        f"{namespace}:{i}:" + hashlib.blake2b(
+            repr(signature[i * MINHASH_ROWS:(i + 1) * MINHASH_ROWS]).encode(), digest_size=8).hexdigest()
+        for i in range(MINHASH_BANDS)
+    ]
+
+class MemoryCacheBackend:
+    """In-process LRU store with per-entry expiry"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bands = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry['text'], entry['signature']
+
+    def set(self, key, text, signature, bands):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'text': text,
+                'signature': signature,
+                'bands': bands,
+                'expires_at': time.time() + self.ttl
+            }
+            for band in bands:
+                self._bands.setdefault(band, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def candidates(self, bands):
+        with self._lock:
+            return set().union(*(self._bands.get(band, ()) for band in bands))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for band in entry['bands']:
+            keys = self._bands.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band]
+
+class DiskCacheBackend:
+    """SQLite store that outlives the process, e.g. across Netlify invocations sharing /tmp"""
+
+    def __init__(self, path, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, text TEXT, signature TEXT, expires_at REAL, last_used REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS bands (band TEXT, key TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS bands_band ON bands (band)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS bands_key ON bands (key)')
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT text, signature, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[2] < time.time():
+                self._remove(key)
+                return None
+            self._db.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+            return row[0], json.loads(row[1])
+
+    def set(self, key, text, signature, bands):
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._remove(key)
+                self._db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?)', (key, text, json.dumps(signature), now + self.ttl, now))
+                self._db.executemany('INSERT INTO bands VALUES (?, ?)', [(band, key) for band in bands])
+                self._db.execute('DELETE FROM entries WHERE expires_at < ?', (now,))
+                self._db.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_size,))
+                self._db.execute('DELETE FROM bands WHERE key NOT IN (SELECT key FROM entries)')
+                self._db.execute('COMMIT')
+            except BaseException:
+                # Leave the connection out of the transaction so later writes can run
+                if self._db.in_transaction:
+                    self._db.execute('ROLLBACK')
+                raise
+
+    def candidates(self, bands):
+        with self._lock:
+            placeholders = ','.join('?' * len(bands))
+            rows = self._db.execute(f'SELECT DISTINCT key FROM bands WHERE band IN ({placeholders})', bands).fetchall()
+            return {row[0] for row in rows}
+
+    def _remove(self, key):
+        self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self._db.execute('DELETE FROM bands WHERE key = ?', (key,))
+
+# Metric label for each of ResponseCache's counters
+CACHE_LOOKUP_RESULTS = {'hits': 'hit', 'near_hits': 'near_hit', 'misses': 'miss'}
+
+class ResponseCache:
+    """Cache of provider responses keyed on (provider, model, normalized input).
+
+    With a similarity threshold set, a miss on the exact key falls back to a
+    MinHash lookup so reworded inputs can reuse a close enough response.
+    """
+
+    def __init__(self, backend, similarity=0):
+        self.backend = backend
+        self.similarity = similarity
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        metrics.inc('motivation_cache_lookups_total', result=CACHE_LOOKUP_RESULTS[counter])
+
+    def get(self, provider, model, user_input):
+        """Look up a response; a failed read is logged and counted as a miss"""
+        normalized = normalize_input(user_input)
+        namespace = f"{provider}:{model}"
+        try:
+            cached = self.backend.get(hashlib.sha256(f"{namespace}:{normalized}".encode()).hexdigest())
+            if cached is not None:
+                self._count('hits')
+                return cached[0]
+            if self.similarity > 0:
+                signature = minhash_signature(normalized)
+                for key in self.backend.candidates(signature_bands(namespace, signature)):
+                    candidate = self.backend.get(key)
+                    if candidate is None:
+                        continue
+                    matches = sum(x == y for x, y in zip(signature, candidate[1]))
+                    if matches / len(signature) >= self.similarity:
+                        self._count('near_hits')
+                        return candidate[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read from the response cache: {str(e)}")
+        self._count('misses')
+        return None
+
+    def set(self, provider, model, user_input, text):
+        """Store a response; a failed write is logged rather than failing the request that paid for it"""
+        normalized = normalize_input(user_input)
+        namespace = f"{provider}:{model}"
+        # Without near-duplicate lookup nothing reads the signature or bands
+        signature = minhash_signature(normalized) if self.similarity > 0 else []
+        try:
+            self.backend.set(
+                hashlib.sha256(f"{namespace}:{normalized}".encode()).hexdigest(),
+                text,
+                signature,
+                signature_bands(namespace, signature) if signature else []
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write to the response cache: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.near_hits) / lookups if lookups else 0.0
+            }
+
+def create_response_cache():
+    if RESPONSE_CACHE == 'off':
+        return None
+    if RESPONSE_CACHE == 'disk':
+        backend = DiskCacheBackend(RESPONSE_CACHE_PATH, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    else:
+        backend = MemoryCacheBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    return ResponseCache(backend, RESPONSE_CACHE_SIMILARITY)
+
+response_cache = create_response_cache()
+
+# Reference markers like [1], [2], and a trailing marker that may still be arriving
+REFERENCE_MARKER = re.compile(r'\[\d+\]')
+PARTIAL_REFERENCE_MARKER = re.compile(r'\[\d*$')
+
+# The "This Day in History" fact is appended after generation, so responses
+# only need room for the motivational text itself
+MAX_TOKENS = int(os.getenv('MAX_TOKENS', 800))
+# Budget for responses that write their own "This Day in History" fact, when
+# the precomputed facts are unavailable (see history_facts_enabled)
+MAX_TOKENS_WITH_FACT = int(os.getenv('MAX_TOKENS_WITH_FACT', 1000))
+
+def response_max_tokens():
+    return MAX_TOKENS if history_facts_enabled() else MAX_TOKENS_WITH_FACT
+
+def build_prompt(user_input):
+    """Build the prompt sent to every LLM provider.
+
+    Without precomputed facts the response is asked to write its own "This Day
+    in History" fact.
+    """
+    requirements = ['Be motivational and uplifting', 'Include specific, actionable steps']
+    if not history_facts_enabled():
+        requirements.append('End with a fun "This Day in History" fact')
+    requirements += ['Use markdown formatting for better readability', 'Keep the tone positive and encouraging']
+    numbered = ''.join(f"    {number}. {requirement}\n" for number, requirement in enumerate(requirements, 1))
+    return f"""Please provide a motivational and actionable response to the following situation, limited to 500 words:
+    {user_input}
+    
+    Requirements:
+{numbered}    """
+
+def call_provider(prompt, provider, api_key, max_tokens=None):
+    """Send the prompt to the provider and return the completion text, raising on failure"""
+    max_tokens = max_tokens or response_max_tokens()
+    # Acquire the client first so its setup isn't counted as upstream time
+    if provider in PROVIDER_CLIENT_FACTORIES:
+        client = get_client(provider, api_key)
+    elif provider in LOCAL_BACKENDS:
+        with timed_stage('client_acquisition'):
+            client = LOCAL_BACKENDS[provider]()
+    else:
+        client = http_session
+
+    with timed_stage('upstream'):
+        if provider == 'perplexity':
+            headers = {
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            }
+            data = {
+                "model": PROVIDER_MODELS['perplexity'],
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": max_tokens
+            }
+            response = client.post(f"{PERPLEXITY_BASE_URL}/chat/completions", headers=headers, json=data, timeout=PROVIDER_TIMEOUT)
+            response.raise_for_status()
+            return response.json()['choices'][0]['message']['content']
+        elif provider == 'openai':
+            response = client.chat.completions.create(
+                model=PROVIDER_MODELS['openai'],
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens
+            )
+            return response.choices[0].message.content
+        elif provider == 'mistral':
+            headers = {
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            }
+            data = {
+                "model": PROVIDER_MODELS['mistral'],
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": max_tokens
+            }
+            response = client.post(f"{MISTRAL_BASE_URL}/chat/completions", headers=headers, json=data, timeout=PROVIDER_TIMEOUT)
+            response.raise_for_status()
+            return response.json()['choices'][0]['message']['content']
+        elif provider == 'gemini':
+            response = client.generate_content(prompt, generation_config={'max_output_tokens': max_tokens})
+            return response.text
+        elif provider == 'huggingface':
+            response = client.text_generation(
+                prompt,
+                max_new_tokens=max_tokens,
+                temperature=0.7,
+                return_full_text=False
+            )
+            return response
+        elif provider in LOCAL_BACKENDS:
+            return client.generate(prompt, max_tokens=max_tokens)
+        raise ValueError(f"Unknown provider: {provider}")
+
+# Hedging and circuit breaker settings (seconds unless noted)
+HEDGE_DELAY_DEFAULT = float(os.getenv('HEDGE_DELAY_DEFAULT', 3))
+HEDGE_DELAY_MIN = float(os.getenv('HEDGE_DELAY_MIN', 0.5))
+HEDGE_DELAY_MAX = float(os.getenv('HEDGE_DELAY_MAX', 10))
+# Workers in each of the two hedging pools: one for a request's first call, one for its hedges
+HEDGE_MAX_WORKERS = int(os.getenv('HEDGE_MAX_WORKERS', 32))
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', 20))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 5))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', 0.5))
+BREAKER_SLOW_CALL = float(os.getenv('BREAKER_SLOW_CALL', 20))
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', 30))
+
+class CircuitBreaker:
+    """Tracks a provider's recent outcomes and skips it while they look bad.
+
+    Opens when the error rate or p95 latency over the last `window` calls
+    crosses its threshold. After `cooldown` seconds one trial call is let
+    through, and only its outcome decides whether the breaker closes again;
+    calls that were already running, and streams, don't.
+    """
+
+    def __init__(self, window, min_calls, error_rate, slow_call, cooldown):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """(allowed, trial): whether a call may go out now, and whether it holds the half-open trial slot.
+
+        A call holding the trial must pass trial=True to record().
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True, False
+            if self._trial_in_flight or time.monotonic() - self._opened_at < self.cooldown:
+                return False, False
+            self._trial_in_flight = True
+            return True, True
+
+    def record(self, ok, latency, trial=False):
+        with self._lock:
+            if trial:
+                self._trial_in_flight = False
+                if ok:
+                    self._outcomes.clear()
+                    self._opened_at = None
+                else:
+                    self._opened_at = time.monotonic()
+            self._outcomes.append((ok, latency))
+            if self._opened_at is None and self._should_open():
+                self._opened_at = time.monotonic()
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return 'open'
+            return 'half_open'
+
+    def latency_percentile(self, q):
+        """Latency percentile of recent successful calls, None until there are enough"""
+        with self._lock:
+            return self._percentile(q)
+
+    def _percentile(self, q):
+        latencies = sorted(latency for ok, latency in self._outcomes if ok)
+        if len(latencies) < self.min_calls:
+            return None
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def _should_open(self):
+        if len(self._outcomes) < self.min_calls:
+            return False
+        errors = sum(not ok for ok, _ in self._outcomes)
+        if errors / len(self._outcomes) >= self.error_rate:
+            return True
+        p95 = self._percentile(0.95)
+        return p95 is not None and p95 > self.slow_call
+
+circuit_breakers = {
+    provider: CircuitBreaker(BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE, BREAKER_SLOW_CALL, BREAKER_COOLDOWN)
+    for provider in PROVIDER_MODELS
+}
+# Calls abandoned when another provider answers first keep their worker until
+# they return, so when a provider hangs its calls fill the primary pool. Hedges
+# have their own pool so they never queue behind those.
+primary_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix='primary')
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix='hedge')
+
+def hedge_delay(provider):
+    """How long to wait on a provider before hedging: its recent p95, clamped"""
+    p95 = circuit_breakers[provider].latency_percentile(0.95)
+    if p95 is None:
+        return HEDGE_DELAY_DEFAULT
+    return min(max(p95, HEDGE_DELAY_MIN), HEDGE_DELAY_MAX)
+
+def timed_call(prompt, provider, api_key, max_tokens=None, trial=False):
+    """call_provider, recording the outcome and latency on the provider's breaker and metrics"""
+    start = time.monotonic()
+    try:
+        response = call_provider(prompt, provider, api_key, max_tokens)
+    except Exception:
+        record_provider_call(provider, False, time.monotonic() - start, trial)
+        raise
+    record_provider_call(provider, True, time.monotonic() - start, trial)
+    return response
+
+def breaker_call(prompt, provider, api_key):
+    """timed_call that first asks the provider's breaker, once the call is actually starting.
+
+    Claiming a half-open breaker's trial slot here rather than when the call
+    is submitted means a call that never runs can't hold the slot.
+    """
+    allowed, trial = circuit_breakers[provider].allow()
+    if not allowed:
+        raise RuntimeError("circuit open")
+    return timed_call(prompt, provider, api_key, trial=trial)
+
+def record_provider_call(provider, ok, latency, trial=False):
+    circuit_breakers[provider].record(ok, latency, trial)
+    metrics.inc('motivation_provider_calls_total', provider=provider, outcome='ok' if ok else 'error')
+    metrics.observe('motivation_provider_seconds', latency, provider=provider)
+
+# How long a request waits on an identical in-flight request before giving up
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', PROVIDER_TIMEOUT))
+
+# Provider responses that are about the caller's API key (invalid, not
+# permitted, over quota) rather than the request
+KEY_ERROR_STATUSES = (401, 403, 429)
+
+def is_key_error(e):
+    """Whether a provider call failed because of its API key.
+
+    requests and huggingface_hub errors carry the response, the OpenAI SDK
+    sets status_code and google.api_core sets code.
+    """
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(e, 'status_code', None) or getattr(e, 'code', None)
+    return status in KEY_ERROR_STATUSES
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one.
+
+    The first caller runs the call; callers arriving while it is in flight
+    wait up to `timeout` seconds and receive its result, or its exception.
+    An error caused by the leader's API key (is_key_error) is only shared with
+    callers using the same `credential`; the others retry, coalesced with the
+    callers that share theirs.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout, credential=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = (Future(), credential)
+        future, leader_credential = call
+
+        if not leader:
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                raise TimeoutError(f"Timed out after {timeout:g}s waiting for an identical in-flight request")
+            except Exception as e:
+                if credential == leader_credential or not is_key_error(e):
+                    raise
+            return self.do((key, credential), fn, timeout, credential)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+single_flight = SingleFlight()
+
+# "This Day in History" settings. The fact is generated once per date, in the
+# background, with HISTORY_FACT_PROVIDER and a server-side key: HISTORY_FACT_API_KEY,
+# or the provider's entry in DEFAULT_API_KEYS. Responses include it once it is
+# stored and never wait for it. HISTORY_FACTS is 'on' or 'off'.
+# On Netlify the store lives in the instance's /tmp, so each warm instance
+# generates the fact once, starting on its first request of the day.
+HISTORY_FACTS = os.getenv('HISTORY_FACTS', 'on')
+HISTORY_FACTS_PATH = os.getenv('HISTORY_FACTS_PATH', os.path.join(tempfile.gettempdir(), 'motivation_history_facts.json'))
+HISTORY_FACTS_KEEP_DAYS = int(os.getenv('HISTORY_FACTS_KEEP_DAYS', 7))
+HISTORY_FACT_PROVIDER = os.getenv('HISTORY_FACT_PROVIDER', 'perplexity')
+HISTORY_FACT_API_KEY = os.getenv('HISTORY_FACT_API_KEY')
+HISTORY_FACT_MAX_TOKENS = int(os.getenv('HISTORY_FACT_MAX_TOKENS', 120))
+HISTORY_FACT_RETRY = float(os.getenv('HISTORY_FACT_RETRY', 300))
+
+class HistoryFactStore:
+    """Daily facts in a JSON file keyed by ISO date, shared by every process using the same path"""
+
+    def __init__(self, path, keep_days, retry):
+        self.path = path
+        self.keep_days = keep_days
+        self.retry = retry
+        self._facts = {}
+        self._generating = set()
+        self._retry_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, day):
+        key = day.isoformat()
+        with self._lock:
+            if key not in self._facts:
+                # Another process may have generated it since the file was last read
+                self._facts = {**self._read(), **self._facts}
+            return self._facts.get(key)
+
+    def set(self, day, fact):
+        key = day.isoformat()
+        oldest = (day - timedelta(days=self.keep_days)).isoformat()
+        with self._lock:
+            facts = {**self._read(), **self._facts, key: fact}
+            self._facts = {stored: value for stored, value in facts.items() if stored > oldest}
+            self._generating.discard(key)
+            self._retry_at.pop(key, None)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump(self._facts, f, indent=2)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not write history facts to {self.path}: {str(e)}")
+
+    def claim(self, day):
+        """Whether the caller should generate the day's fact; only one caller at a time gets True.
+
+        False once the fact is stored, while another caller is generating it,
+        and for a while after generating it failed.
+        """
+        key = day.isoformat()
+        with self._lock:
+            if key in self._facts or key in self._generating or time.monotonic() < self._retry_at.get(key, 0):
+                return False
+            self._generating.add(key)
+            return True
+
+    def record_failure(self, day):
+        key = day.isoformat()
+        with self._lock:
+            self._generating.discard(key)
+            self._retry_at[key] = time.monotonic() + self.retry
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+history_facts = HistoryFactStore(HISTORY_FACTS_PATH, HISTORY_FACTS_KEEP_DAYS, HISTORY_FACT_RETRY) if HISTORY_FACTS == 'on' else None
+
+def build_history_prompt(day):
+    return (f'Share one fun, true "This Day in History" fact about something that happened on {day:%B} {day.day}. '
+            f'Reply with the fact only, in one or two sentences, starting with the year.')
+
+def history_fact_api_key():
+    return HISTORY_FACT_API_KEY or DEFAULT_API_KEYS.get(HISTORY_FACT_PROVIDER)
+
+def history_facts_enabled():
+    """Whether facts can be generated: the store is on and the provider has a server-side key"""
+    return (history_facts is not None and HISTORY_FACT_PROVIDER in PROVIDER_MODELS
+            and (HISTORY_FACT_PROVIDER in LOCAL_BACKENDS or bool(history_fact_api_key())))
+
+def warn_if_history_facts_unavailable():
+    """Log a warning when HISTORY_FACTS is on but facts can't be generated; call once DEFAULT_API_KEYS is filled in"""
+    if history_facts is not None and not history_facts_enabled():
+        logger.warning(f"HISTORY_FACTS is on, but HISTORY_FACT_PROVIDER {HISTORY_FACT_PROVIDER!r} has no server-side key "
+                       f"(set HISTORY_FACT_API_KEY); responses will write their own \"This Day in History\" fact")
+
+def generate_history_fact(day):
+    """Generate and store the day's fact; call only after history_facts.claim(day) returned True"""
+    provider = HISTORY_FACT_PROVIDER
+    allowed, trial = circuit_breakers[provider].allow()
+    if not allowed:
+        logger.warning(f"Not generating the history fact for {day}: {provider} circuit open")
+        history_facts.record_failure(day)
+        return None
+    try:
+        response = timed_call(build_history_prompt(day), provider, history_fact_api_key(), HISTORY_FACT_MAX_TOKENS, trial)
+    except Exception as e:
+        logger.error(f"Error generating the history fact for {day} with {provider}: {str(e)}")
+        history_facts.record_failure(day)
+        return None
+    fact = REFERENCE_MARKER.sub('', response).strip()
+    history_facts.set(day, fact)
+    logger.info(f"Generated the history fact for {day} with {provider}")
+    return fact
+
+def history_fact_suffix():
+    """Markdown for today's fact to append to a response, or '' if it isn't stored yet.
+
+    The first call of the day that finds no fact starts generating it on a
+    background thread; responses never wait for it.
+    """
+    if not history_facts_enabled():
+        return ''
+    today = date.today()
+    fact = history_facts.get(today)
+    if fact is None:
+        if history_facts.claim(today):
+            threading.Thread(target=generate_history_fact, args=(today,), name='history-fact', daemon=True).start()
+        return ''
+    return f"\n\n**This Day in History:** {fact}"
+
+def refresh_history_facts():
+    """Background job generating each day's fact just after midnight"""
+    while True:
+        today = date.today()
+        fact = history_facts.get(today)
+        if fact is None and history_facts.claim(today):
+            fact = generate_history_fact(today)
+        if fact is None:
+            time.sleep(HISTORY_FACT_RETRY)
+            continue
+        tomorrow = datetime.combine(today + timedelta(days=1), datetime.min.time())
+        time.sleep(max((tomorrow - datetime.now()).total_seconds(), 0) + 1)
+
+def fetch_motivational_response(user_input, provider, api_key, throttle=nullcontext()):
+    """Get a response through the cache and single-flight, raising on failure.
+
+    `throttle` wraps only the upstream call, so cache hits and coalesced
+    requests don't count against it.
+    """
+    api_key = api_key or DEFAULT_API_KEYS.get(provider)
+
+    if response_cache is not None:
+        with timed_stage('cache_lookup'):
+            cached = response_cache.get(provider, PROVIDER_MODELS[provider], user_input)
+        if cached is not None:
+            return cached + history_fact_suffix()
+
+    def call_upstream():
+        with timed_stage('prompt_build'):
+            prompt = build_prompt(user_input)
+        with throttle:
+            response = timed_call(prompt, provider, api_key)
+        if response_cache is not None:
+            response_cache.set(provider, PROVIDER_MODELS[provider], user_input, response)
+        return response
+
+    # Identical requests already in flight share that call instead of making their own.
+    # Responses are cached without the day's fact, which is added here.
+    credential = hashlib.sha256((api_key or '').encode()).hexdigest()
+    response = single_flight.do((provider, normalize_input(user_input)), call_upstream, SINGLE_FLIGHT_TIMEOUT, credential)
+    return response + history_fact_suffix()
+
+def get_motivational_response(user_input, provider, api_key=None):
+    """Get a motivational response from the selected LLM provider"""
+    if provider not in PROVIDER_MODELS:
+        return "Invalid provider selected"
+
+    try:
+        return fetch_motivational_response(user_input, provider, api_key)
+    except requests.exceptions.HTTPError as http_err:
+        logger.error(f"HTTP error for {provider}: {http_err}")
+        logger.error(f"Response status code: {http_err.response.status_code}")
+        logger.error(f"Response body: {http_err.response.text}")
+        return f"HTTP error from {provider}: {http_err.response.text}"
+    except Exception as e:
+        logger.error(f"Error getting response from {provider}: {str(e)}")
+        return f"Error getting response from {provider}: {str(e)}"
+
+def get_hedged_response(user_input, providers, api_keys):
+    """Race an ordered list of providers and return (text, provider) for the first to answer.
+
+    The first provider gets the request; if it hasn't answered within its hedge
+    delay, or fails, the next provider whose circuit breaker allows it is tried
+    as well. Calls still running when one succeeds are abandoned.
+    """
+    providers = [provider for provider in providers if provider in PROVIDER_MODELS]
+    if not providers:
+        return "Invalid provider selected", None
+
+    if response_cache is not None:
+        for provider in providers:
+            cached = response_cache.get(provider, PROVIDER_MODELS[provider], user_input)
+            if cached is not None:
+                return cached + history_fact_suffix(), provider
+
+    prompt = build_prompt(user_input)
+    remaining = iter(providers)
+    pending = {}
+    errors = []
+    launched = []
+
+    def launch_next():
+        for provider in remaining:
+            if circuit_breakers[provider].state() == 'open':
+                errors.append(f"{provider}: circuit open")
+                continue
+            api_key = api_keys.get(provider) or DEFAULT_API_KEYS.get(provider)
+            # Run in a copy of this context so stage timings land on this request
+            call = contextvars.copy_context().run
+            # The first call goes to the primary pool, hedges and failovers to the hedge pool
+            executor = hedge_executor if launched else primary_executor
+            pending[executor.submit(call, breaker_call, prompt, provider, api_key)] = provider
+            launched.append(provider)
+            return provider
+        return None
+
+    last_launched = launch_next()
+    deadline = time.monotonic() + PROVIDER_TIMEOUT
+    while pending:
+        remaining_time = deadline - time.monotonic()
+        if remaining_time <= 0:
+            break
+        timeout = min(hedge_delay(last_launched), remaining_time) if last_launched else remaining_time
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        failed = False
+        for future in done:
+            provider = pending.pop(future)
+            try:
+                response = future.result()
+            except Exception as e:
+                logger.error(f"Error getting response from {provider}: {str(e)}")
+                errors.append(f"{provider}: {str(e)}")
+                failed = True
+                continue
+            for other in pending:
+                other.cancel()
+            if response_cache is not None:
+                response_cache.set(provider, PROVIDER_MODELS[provider], user_input, response)
+            return response + history_fact_suffix(), provider
+        # Hedge when the running call is slow, fail over when it errored
+        if last_launched and (failed or not done):
+            last_launched = launch_next()
+
+    for future, provider in pending.items():
+        future.cancel()
+        errors.append(f"{provider}: timed out after {PROVIDER_TIMEOUT:g}s")
+    return f"Error getting response from {', '.join(providers)}: {'; '.join(errors)}", None
+
+# Batch settings; concurrency and rate limits are per provider and shared by all batches
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 16))
+BATCH_PROVIDER_CONCURRENCY = int(os.getenv('BATCH_PROVIDER_CONCURRENCY', 4))
+BATCH_PROVIDER_RATE = float(os.getenv('BATCH_PROVIDER_RATE', 5))
+if BATCH_PROVIDER_CONCURRENCY < 1 or BATCH_PROVIDER_RATE <= 0:
+    raise ValueError(f"BATCH_PROVIDER_CONCURRENCY must be at least 1 and BATCH_PROVIDER_RATE above 0, "
+                     f"got {BATCH_PROVIDER_CONCURRENCY} and {BATCH_PROVIDER_RATE:g}")
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per second with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+class ProviderThrottle:
+    """Caps in-flight calls to a provider and paces how fast new ones start"""
+
+    def __init__(self, concurrency, rate):
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._rate_limiter = RateLimiter(rate, concurrency)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        self._rate_limiter.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+
+provider_throttles = {
+    provider: ProviderThrottle(BATCH_PROVIDER_CONCURRENCY, BATCH_PROVIDER_RATE)
+    for provider in PROVIDER_MODELS
+}
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch')
+
+def normalize_batch_items(body, api_key_field):
+    """Turn a batch request body into a list of {'text', 'provider', api_key_field} items.
+
+    'items' may hold plain strings or objects overriding the top-level
+    'provider' and API key per item. An item that is neither becomes
+    {'error': ...} and gets an error result; a body that isn't an object
+    with an 'items' list raises ValueError.
+    """
+    if not isinstance(body, dict) or not isinstance(body.get('items', []), list):
+        raise ValueError("The request body must be a JSON object with an 'items' list")
+    defaults = {
+        'text': '',
+        'provider': body.get('provider', 'perplexity'),
+        api_key_field: body.get(api_key_field, '')
+    }
+    items = []
+    for item in body.get('items', []):
+        if isinstance(item, str):
+            item = {'text': item}
+        if not isinstance(item, dict):
+            items.append({'error': "Each item must be a string or an object"})
+            continue
+        item = {**defaults, **{field: item[field] for field in defaults if field in item}}
+        if not (isinstance(item['text'], str) and isinstance(item['provider'], str)
+                and isinstance(item[api_key_field], (str, type(None)))):
+            items.append({'error': f"'text' and 'provider' must be strings, and '{api_key_field}' a string or null"})
+            continue
+        items.append(item)
+    return items
+
+def run_batch_item(index, item, api_key_field):
+    if 'error' in item:
+        return {'index': index, 'error': item['error']}
+    provider = item['provider']
+    if provider not in PROVIDER_MODELS:
+        return {'index': index, 'provider': provider, 'error': "Invalid provider selected"}
+    try:
+        text = fetch_motivational_response(item['text'], provider, item[api_key_field], provider_throttles[provider])
+    except Exception as e:
+        logger.error(f"Error getting response from {provider} for batch item {index}: {str(e)}")
+        return {'index': index, 'provider': provider, 'error': f"Error getting response from {provider}: {str(e)}"}
+    return {'index': index, 'provider': provider, 'text': REFERENCE_MARKER.sub('', text)}
+
+def iter_batch(items, api_key_field):
+    """Fan items out over the batch pool and yield each result as soon as it completes.
+
+    Each item runs in a copy of this context, so its stage timings add up on
+    the batch request.
+    """
+    futures = [
+        batch_executor.submit(contextvars.copy_context().run, run_batch_item, index, item, api_key_field)
+        for index, item in enumerate(items)
+    ]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Stop queued items if the consumer goes away (e.g. the client disconnected)
+        for future in futures:
+            future.cancel()
+
+def stream_chat_completion(url, api_key, model, prompt, max_tokens):
+    """Yield content deltas from an OpenAI-compatible chat completions SSE stream"""
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "stream": True
+    }
+    with http_session.post(url, headers=headers, json=data, stream=True, timeout=PROVIDER_TIMEOUT) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            payload = line[len('data:'):].strip()
+            if payload == '[DONE]':
+                break
+            choices = json.loads(payload).get('choices') or [{}]
+            content = choices[0].get('delta', {}).get('content')
+            if content:
+                yield content
+
+def stream_provider(prompt, provider, api_key):
+    """Yield completion text from the provider as it is generated"""
+    max_tokens = response_max_tokens()
+    if provider == 'perplexity':
+        yield from stream_chat_completion(f"{PERPLEXITY_BASE_URL}/chat/completions", api_key, PROVIDER_MODELS['perplexity'], prompt, max_tokens)
+    elif provider == 'openai':
+        stream = get_client('openai', api_key).chat.completions.create(
+            model=PROVIDER_MODELS['openai'],
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    elif provider == 'mistral':
+        yield from stream_chat_completion(f"{MISTRAL_BASE_URL}/chat/completions", api_key, PROVIDER_MODELS['mistral'], prompt, max_tokens)
+    elif provider == 'gemini':
+        for chunk in get_client('gemini', api_key).generate_content(prompt, stream=True, generation_config={'max_output_tokens': max_tokens}):
+            yield chunk.text
+    elif provider == 'huggingface':
+        yield from get_client('huggingface', api_key).text_generation(
+            prompt,
+            max_new_tokens=max_tokens,
+            temperature=0.7,
+            return_full_text=False,
+            stream=True
+        )
+    elif provider in LOCAL_BACKENDS:
+        yield from LOCAL_BACKENDS[provider]().stream(prompt, max_tokens=max_tokens)
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+
+def stream_motivational_response(user_input, provider, api_key=None):
+    """Yield a motivational response from the selected LLM provider as it is generated"""
+    if provider not in PROVIDER_MODELS:
+        yield "Invalid provider selected"
+        return
+    api_key = api_key or DEFAULT_API_KEYS.get(provider)
+
+    if response_cache is not None:
+        with timed_stage('cache_lookup'):
+            cached = response_cache.get(provider, PROVIDER_MODELS[provider], user_input)
+        if cached is not None:
+            yield cached + history_fact_suffix()
+            return
+
+    with timed_stage('prompt_build'):
+        prompt = build_prompt(user_input)
+
+    # The upstream stage and provider latency only count the time spent waiting
+    # on the provider, not the time suspended at yield while the consumer sends
+    # each chunk on, so a slow client doesn't make the provider look slow
+    chunks = []
+    upstream = 0.0
+    stream = stream_provider(prompt, provider, api_key)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(stream)
+            except StopIteration:
+                break
+            finally:
+                upstream += time.perf_counter() - start
+            chunks.append(chunk)
+            yield chunk
+    except Exception:
+        record_provider_call(provider, False, upstream)
+        raise
+    finally:
+        stream.close()
+        record_stage('upstream', upstream)
+    record_provider_call(provider, True, upstream)
+
+    # Only a stream that ran to completion is cached, without the day's fact
+    if response_cache is not None:
+        response_cache.set(provider, PROVIDER_MODELS[provider], user_input, ''.join(chunks))
+    suffix = history_fact_suffix()
+    if suffix:
+        yield suffix
+
+def strip_reference_markers(chunks):
+    """Remove reference markers from a stream of text chunks.
+
+    A marker split across chunk boundaries (e.g. "[1" then "2]") is held back
+    until it is either completed and dropped, or turns out to be plain text.
+    """
+    pending = ''
+    for chunk in chunks:
+        pending = REFERENCE_MARKER.sub('', pending + chunk)
+        partial = PARTIAL_REFERENCE_MARKER.search(pending)
+        cut = partial.start() if partial else len(pending)
+        if cut:
+            yield pending[:cut]
+        pending = pending[cut:]
+    if pending:
+        yield pending
+
+def sse_events(chunks, provider):
+    """Format text chunks as Server-Sent Events, ending with a [DONE] event"""
+    start = time.perf_counter()
+    first = True
+    try:
+        for chunk in strip_reference_markers(chunks):
+            if first:
+                metrics.observe('motivation_time_to_first_token_seconds', time.perf_counter() - start, provider=provider)
+                first = False
+            yield f"data: {json.dumps({'text': chunk})}\n\n"
+    except Exception as e:
+        logger.error(f"Error streaming response from {provider}: {str(e)}")
+        yield f"data: {json.dumps({'error': f'Error getting response from {provider}: {str(e)}'})}\n\n"
+    yield "data: [DONE]\n\n"
+
+def register_local_provider(provider, model, get_backend):
+    """Add a provider served in-process, such as the Flask server's llama.cpp pool"""
+    PROVIDER_MODELS[provider] = model
+    LOCAL_BACKENDS[provider] = get_backend
+    circuit_breakers[provider] = CircuitBreaker(BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE, BREAKER_SLOW_CALL, BREAKER_COOLDOWN)
+    provider_throttles[provider] = ProviderThrottle(BATCH_PROVIDER_CONCURRENCY, BATCH_PROVIDER_RATE)
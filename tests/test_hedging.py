@@ -0,0 +1,76 @@
+"""Hedged requests against a hanging primary provider, using the mock provider servers."""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'netlify', 'functions'), os.path.join(ROOT, 'benchmarks')]
+
+import motivation_core
+from mock_providers import MockProviderServer
+
+WORKERS = 4
+HANG = 3.0
+
+@pytest.fixture
+def hanging_primary(monkeypatch):
+    """Perplexity hangs for HANG seconds, Mistral answers quickly; small pools, no cache or facts"""
+    hung = MockProviderServer('perplexity', latency=f'fixed:{HANG}').start()
+    fast = MockProviderServer('mistral', latency='fixed:0.05').start()
+    primary_executor = ThreadPoolExecutor(max_workers=WORKERS)
+    hedge_executor = ThreadPoolExecutor(max_workers=WORKERS)
+
+    monkeypatch.setattr(motivation_core, 'PERPLEXITY_BASE_URL', hung.url)
+    monkeypatch.setattr(motivation_core, 'MISTRAL_BASE_URL', fast.url + '/v1')
+    monkeypatch.setattr(motivation_core, 'HEDGE_DELAY_DEFAULT', 0.2)
+    monkeypatch.setattr(motivation_core, 'response_cache', None)
+    monkeypatch.setattr(motivation_core, 'history_facts', None)
+    monkeypatch.setattr(motivation_core, 'primary_executor', primary_executor)
+    monkeypatch.setattr(motivation_core, 'hedge_executor', hedge_executor)
+    for provider in ('perplexity', 'mistral'):
+        monkeypatch.setitem(motivation_core.circuit_breakers, provider, motivation_core.CircuitBreaker(
+            motivation_core.BREAKER_WINDOW, motivation_core.BREAKER_MIN_CALLS, motivation_core.BREAKER_ERROR_RATE,
+            motivation_core.BREAKER_SLOW_CALL, motivation_core.BREAKER_COOLDOWN))
+    yield
+    primary_executor.shutdown(wait=False, cancel_futures=True)
+    hedge_executor.shutdown(wait=False, cancel_futures=True)
+    hung.stop()
+    fast.stop()
+
+def test_hedges_start_while_primaries_hang(hanging_primary):
+    def request(index):
+        start = time.perf_counter()
+        text, provider = motivation_core.get_hedged_response(
+            f"Request {index}: I can't get started on my thesis",
+            ['perplexity', 'mistral'],
+            {'perplexity': 'key', 'mistral': 'key'}
+        )
+        return provider, time.perf_counter() - start
+
+    # Four times as many requests as workers, so the hung primaries fill their pool
+    with ThreadPoolExecutor(max_workers=WORKERS * 4) as clients:
+        results = list(clients.map(request, range(WORKERS * 4)))
+
+    assert [provider for provider, _ in results] == ['mistral'] * len(results)
+    assert max(elapsed for _, elapsed in results) < HANG / 2
+
+def test_only_the_trial_call_decides_a_half_open_breaker():
+    breaker = motivation_core.CircuitBreaker(window=4, min_calls=2, error_rate=0.5, slow_call=10, cooldown=0.05)
+    breaker.record(False, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state() == 'open'
+    time.sleep(0.1)
+
+    assert breaker.allow() == (True, True)
+    assert breaker.allow() == (False, False)
+    # A call that started before the breaker opened finishes during the trial
+    breaker.record(True, 0.1)
+    assert breaker.state() == 'half_open'
+    assert breaker.allow() == (False, False)
+
+    breaker.record(True, 0.1, trial=True)
+    assert breaker.state() == 'closed'
+    assert breaker.allow() == (True, False)
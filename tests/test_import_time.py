@@ -0,0 +1,23 @@
+"""Cold-start import budgets, measured with benchmarks/import_time.py."""
+import os
+import statistics
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from import_time import TARGETS, LAZY_MODULES, import_times
+
+RUNS = 3
+
+@pytest.mark.parametrize('target', list(TARGETS))
+def test_entry_module_imports_within_budget(target):
+    directory, module, budget_ms = TARGETS[target]
+    runs_times = [import_times(directory, module) for _ in range(RUNS)]
+
+    eager = [lazy for lazy in LAZY_MODULES if any(lazy in times for times in runs_times)]
+    assert not eager, f"{module} imports provider SDKs eagerly: {', '.join(eager)}"
+    median_ms = statistics.median(times[module] for times in runs_times) / 1000
+    assert median_ms <= budget_ms, f"{module} imports in {median_ms:.1f} ms, over its {budget_ms:.0f} ms budget"
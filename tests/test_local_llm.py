@@ -0,0 +1,113 @@
+"""The warm llama.cpp worker pool, run against benchmarks/fake_llama_server.py."""
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import local_llm
+from local_llm import LocalLLMPool
+
+FAKE_SERVER = os.path.join(ROOT, 'benchmarks', 'fake_llama_server.py')
+TOKEN_DELAY = 0.02
+COMMAND = f'"{sys.executable}" "{FAKE_SERVER}" --port {{port}} --token-delay {TOKEN_DELAY}'
+FAILING_COMMAND = f'"{sys.executable}" -c "raise SystemExit(1)"'
+
+def free_base_port(workers):
+    """A port where `workers` consecutive ports are free"""
+    for _ in range(20):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            base = probe.getsockname()[1]
+        if base + workers > 65535:
+            continue
+        sockets = []
+        try:
+            for port in range(base, base + workers):
+                sock = socket.socket()
+                sockets.append(sock)
+                sock.bind(('127.0.0.1', port))
+            return base
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+    raise RuntimeError("No free ports")
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the condition")
+        time.sleep(0.02)
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    monkeypatch.setattr(local_llm, 'LOCAL_LLM_STARTUP_TIMEOUT', 10)
+    monkeypatch.setattr(local_llm, 'LOCAL_LLM_QUEUE_TIMEOUT', 20)
+    monkeypatch.setattr(local_llm, 'LOCAL_LLM_RESTART_BACKOFF', 0.1)
+    pools = []
+
+    def make(workers):
+        pool = LocalLLMPool(workers=workers, base_port=free_base_port(workers), command=COMMAND)
+        pools.append(pool)
+        pool.start(timeout=10)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+def test_prompts_queue_across_workers(make_pool):
+    pool = make_pool(2)
+    with ThreadPoolExecutor(max_workers=4) as clients:
+        replies = [clients.submit(pool.generate, 'Motivate me', 20) for _ in range(4)]
+        # Two prompts run while the other two wait in line
+        wait_for(lambda: pool.stats()['queue_depth'] == 2)
+        stats = pool.stats()
+        assert stats['idle_workers'] == 0
+        assert [worker['busy'] for worker in stats['workers']] == [True, True]
+        replies = [reply.result() for reply in replies]
+
+    assert len(set(replies)) == 1 and replies[0].startswith("You've got this!")
+    stats = pool.stats()
+    assert stats['queue_depth'] == 0
+    assert stats['idle_workers'] == 2
+    assert [worker['requests'] for worker in stats['workers']] == [2, 2]
+    assert all(0 < worker['utilization'] <= 1 for worker in stats['workers'])
+
+def test_killed_worker_is_restarted(make_pool):
+    pool = make_pool(1)
+    worker = pool.workers[0]
+    old_pid = worker.process.pid
+    worker.process.kill()
+    worker.process.wait()
+
+    # The prompt finds the worker dead, restarts it and waits for it
+    assert pool.generate('Motivate me', 5).startswith("You've got this!")
+    assert worker.process.pid != old_pid
+    assert pool.stats()['workers'][0]['alive']
+
+def test_failed_restart_is_retried_with_backoff(make_pool, caplog):
+    pool = make_pool(1)
+    worker = pool.workers[0]
+    worker.process.kill()
+    worker.process.wait()
+    worker.command = FAILING_COMMAND
+
+    with ThreadPoolExecutor(max_workers=1) as client:
+        reply = client.submit(pool.generate, 'Motivate me', 5)
+        wait_for(lambda: 'Failed to restart local LLM worker 0' in caplog.text)
+        assert not reply.done()
+        assert pool.stats()['queue_depth'] == 1
+
+        # The next attempt after the backoff uses the working command again
+        worker.command = COMMAND
+        assert reply.result(timeout=20).startswith("You've got this!")
+    assert worker.alive()
@@ -0,0 +1,67 @@
+"""Coalescing identical in-flight calls, and keeping API key errors to the key that caused them."""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'netlify', 'functions'))
+
+from motivation_core import SingleFlight
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+def run_coalesced(flight, calls, release):
+    """Start the first call as the leader, then the rest as followers, and let the leader finish"""
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        futures = [pool.submit(flight.do, 'key', fn, 5, credential) for credential, fn in calls[:1]]
+        while not flight._calls:
+            time.sleep(0.01)
+        futures += [pool.submit(flight.do, 'key', fn, 5, credential) for credential, fn in calls[1:]]
+        # Give the followers time to start waiting on the leader
+        time.sleep(0.2)
+        release.set()
+        return [future.exception() or future.result() for future in futures]
+
+def test_followers_share_the_leaders_result():
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        return 'done'
+
+    results = run_coalesced(SingleFlight(), [('a', fn), ('a', fn), ('b', fn)], release)
+    assert results == ['done'] * 3
+    assert len(calls) == 1
+
+@pytest.mark.parametrize('status', [401, 403, 429])
+def test_key_errors_are_not_shared_with_other_keys(status):
+    release = threading.Event()
+
+    def leader():
+        release.wait()
+        raise http_error(status)
+
+    results = run_coalesced(SingleFlight(), [('a', leader), ('a', lambda: 'a'), ('b', lambda: 'b')], release)
+    assert isinstance(results[0], requests.HTTPError)
+    assert isinstance(results[1], requests.HTTPError)
+    assert results[2] == 'b'
+
+def test_other_errors_are_shared():
+    release = threading.Event()
+
+    def leader():
+        release.wait()
+        raise http_error(500)
+
+    results = run_coalesced(SingleFlight(), [('a', leader), ('b', lambda: 'b')], release)
+    assert all(isinstance(result, requests.HTTPError) for result in results)